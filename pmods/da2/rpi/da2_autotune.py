@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+SPI clock / transfer size autotuner for the DA2.
+
+Sweeps clock speed, chunk size and XferMode, checks every configuration for
+data integrity and keeps the fastest error free one per device, so each rig
+runs at what its wiring actually supports rather than a conservative guess.
+
+Integrity is checked by loopback : with MOSI jumpered to MISO the bytes read
+back during a transfer must equal the bytes sent.  FakeSpiDev(loopback = True)
+loops back in software (and can be told to corrupt data above max_reliable_hz).
+Clocks are swept upwards and the sweep stops at the first clock where any
+configuration fails : the best is picked from the clocks below it, which all
+ran clean.
+
+Note XFER1 releases CS between bytes, which the DA2 needs held for a 16 bit
+frame; it passes loopback but is only kept if explicitly included in modes.
+
+Results persist as JSON keyed by SPI device, see load_tuning/save_tuning.
+
+Adam Stephen.
+"""
+
+import json
+import os
+import random
+import time
+
+from da2_common import XferMode, sender
+
+"""-----------------------------------------------------------"""
+
+TUNING_FILE = os.path.expanduser('~/.config/my-iot/da2_tuning.json')
+
+SPEEDS = [int(1e04), int(1e05), int(5e05), int(1e06), int(2e06), int(4e06),
+          int(8e06), int(16e06), int(32e06)]
+CHUNK_SIZES = [256, 1024, 4096]
+MODES = [XferMode.XFER2, XferMode.XFER3]
+
+PATTERN_BYTES = 8192
+# minimum time spent per configuration (slow clocks just send the pattern once)
+MIN_SECONDS = 0.05
+
+
+def device_key(dac):
+    return 'spidev%d.%d' % (dac.pmod.SPI_port, dac.pmod.CS_pin)
+
+
+def test_pattern(n = PATTERN_BYTES, seed = 0):
+    """Random bytes : exercises every bit transition, unlike a ramp."""
+    rng = random.Random(seed)
+    return [rng.randrange(256) for i in range(n)]
+
+
+def check_config(spi, speed, chunk_size, mode, pattern):
+    """Returns (error free, bytes per second) for one configuration."""
+    spi.max_speed_hz = speed
+    send = sender(spi, mode)
+    chunks = [pattern[i:i + chunk_size] for i in range(0, len(pattern), chunk_size)]
+    sent = 0
+    start = time.perf_counter()
+    while True:
+        for chunk in chunks:
+            if list(send(list(chunk))) != chunk:
+                return False, 0.0
+        sent += len(pattern)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            break
+    return True, sent / elapsed
+
+
+def autotune(dac, speeds = SPEEDS, chunk_sizes = CHUNK_SIZES, modes = MODES, verbose = False):
+    """
+    Sweep all configurations, return (best tuning dict or None, list of results).
+    The device is left at the best configuration found (or its original clock).
+    """
+    spi = dac.spi
+    original_speed = spi.max_speed_hz
+    pattern = test_pattern()
+    results = []
+    for speed in sorted(speeds):
+        clean = True
+        for mode in modes:
+            for chunk_size in chunk_sizes:
+                ok, rate = check_config(spi, speed, chunk_size, mode, pattern)
+                result = dict(spi_clock_speed = speed, chunk_size = chunk_size,
+                              mode = mode.value, ok = ok, bytes_per_second = rate)
+                results.append(result)
+                clean = clean and ok
+                if verbose:
+                    print("%10d Hz %-14s chunk %5d : %s %12.0f B/s" %
+                          (speed, mode, chunk_size, 'ok ' if ok else 'ERR', rate))
+        if not clean:
+            break
+    failed = set(r['spi_clock_speed'] for r in results if not r['ok'])
+    good = [r for r in results if r['spi_clock_speed'] not in failed]
+    if not good:
+        spi.max_speed_hz = original_speed
+        return None, results
+    best = max(good, key = lambda r: r['bytes_per_second'])
+    tuning = dict(spi_clock_speed = best['spi_clock_speed'], chunk_size = best['chunk_size'],
+                  mode = best['mode'], bytes_per_second = best['bytes_per_second'])
+    dac.apply_tuning(tuning)
+    return tuning, results
+
+
+def load_tunings(path = TUNING_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_tuning(dac, path = TUNING_FILE):
+    """Persisted tuning for this device, or None."""
+    return load_tunings(path).get(device_key(dac))
+
+
+def save_tuning(dac, tuning, path = TUNING_FILE):
+    tunings = load_tunings(path)
+    tunings[device_key(dac)] = tuning
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'w') as f:
+        json.dump(tunings, f, indent = 2, sort_keys = True)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Trigger synchronised DA2 burst mode.
+
+Sequences are encoded and staged up front (preload) so that nothing but the
+SPI ioctl is left on the path between the trigger and the first byte.  A burst
+is armed against a trigger source and fires on a GPIO edge or a software
+trigger.
+
+Trigger sources provide wait(timeout) returning the trigger time in
+CLOCK_MONOTONIC nanoseconds (or None on timeout):
+
+    GpioEdgeTrigger    : gpio character device edge events via libgpiod (v2 API),
+                         timestamped by the kernel
+    SoftwareTrigger    : fire() from Python
+    FakeGpioEventSource: SoftwareTrigger with an edge() helper for testing off the Pi
+
+The latency recorded per burst is trigger timestamp -> entry to the SPI
+transfer of the first chunk ("first_byte"), plus the time to complete the
+whole sequence.  The byte reaches the wire a little after the ioctl is
+entered; that part is a fixed cost of the kernel driver.
+
+Adam Stephen.
+"""
+
+import statistics
+import threading
+import time
+
+from da2_common import SPIDEV_BUFSIZ, XferMode, chunk, encode, sender
+
+"""-----------------------------------------------------------"""
+
+
+class SoftwareTrigger:
+    def __init__(self):
+        self.event = threading.Event()
+        self.timestamp_ns = None
+
+    def fire(self):
+        self.timestamp_ns = time.monotonic_ns()
+        self.event.set()
+
+    def wait(self, timeout = None):
+        if not self.event.wait(timeout):
+            return None
+        self.event.clear()
+        return self.timestamp_ns
+
+    def close(self):
+        pass
+
+
+class FakeGpioEventSource(SoftwareTrigger):
+    """Stands in for GpioEdgeTrigger : edges carry their own (monotonic) timestamp."""
+    def __init__(self, line = 0):
+        SoftwareTrigger.__init__(self)
+        self.line = line
+        self.edges = 0
+
+    def edge(self, timestamp_ns = None):
+        self.edges += 1
+        self.timestamp_ns = timestamp_ns if timestamp_ns is not None else time.monotonic_ns()
+        self.event.set()
+
+    def edge_after(self, delay):
+        """Generate an edge from another thread after delay seconds."""
+        timer = threading.Timer(delay, self.edge)
+        timer.start()
+        return timer
+
+
+class GpioEdgeTrigger:
+    def __init__(self, chip = '/dev/gpiochip0', line = 17, rising = True):
+        import gpiod
+        from gpiod.line import Edge
+        self.line = line
+        settings = gpiod.LineSettings(edge_detection = Edge.RISING if rising else Edge.FALLING)
+        self.request = gpiod.request_lines(chip, consumer = 'da2-burst',
+                                           config = {line: settings})
+
+    def wait(self, timeout = None):
+        if not self.request.wait_edge_events(timeout):
+            return None
+        # kernel event timestamps default to CLOCK_MONOTONIC
+        return self.request.read_edge_events()[0].timestamp_ns
+
+    def close(self):
+        self.request.release()
+
+
+class BurstPlayer:
+    def __init__(self, dac, mode = XferMode.XFER2):
+        self.dac = dac
+        self.mode = mode
+        self.sequences = {}
+        self.results = []
+        self.thread = None
+        self.done = threading.Event()
+
+    def preload(self, name, values):
+        """Encode and stage a sequence, split into chunks the transfer mode accepts."""
+        buffer = encode(values)
+        if self.mode == XferMode.XFER3:
+            self.sequences[name] = [tuple(buffer)]
+        else:
+            # autotuned chunk size if the DA2 has one
+            self.sequences[name] = chunk(buffer, self.dac.chunk_size or SPIDEV_BUFSIZ)
+
+    def arm(self, name, trigger, count = 1, timeout = None):
+        """Wait for count triggers in the background, playing the sequence on each."""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError('burst already armed')
+        chunks = self.sequences[name]
+        send = sender(self.dac.spi, self.mode)
+        self.done.clear()
+        self.thread = threading.Thread(target = self._run,
+                                       args = (name, chunks, send, trigger, count, timeout),
+                                       daemon = True)
+        self.thread.start()
+
+    def _run(self, name, chunks, send, trigger, count, timeout):
+        clock = time.monotonic_ns
+        try:
+            for i in range(count):
+                # fresh copies are made before the wait, off the trigger -> first byte path
+                staged = [list(c) for c in chunks]
+                t_trigger = trigger.wait(timeout)
+                if t_trigger is None:
+                    break
+                t_first = clock()
+                for chunk in staged:
+                    send(chunk)
+                t_done = clock()
+                self.results.append(dict(sequence = name,
+                                         trigger_ns = t_trigger,
+                                         first_byte_ns = t_first - t_trigger,
+                                         complete_ns = t_done - t_trigger))
+        finally:
+            self.done.set()
+
+    def wait(self, timeout = None):
+        """Wait for the armed burst(s) to finish."""
+        return self.done.wait(timeout)
+
+    def report(self):
+        if not self.results:
+            return dict(bursts = 0)
+        first = [r['first_byte_ns'] / 1e3 for r in self.results]
+        complete = [r['complete_ns'] / 1e3 for r in self.results]
+        return dict(bursts = len(self.results),
+                    first_byte_us_min = min(first),
+                    first_byte_us_median = statistics.median(first),
+                    first_byte_us_max = max(first),
+                    complete_us_median = statistics.median(complete))
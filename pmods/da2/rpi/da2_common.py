@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Types and helpers shared by the DA2 driver (ut_dac_set_level.py) and the da2_*
+helpers.
+
+Kept out of ut_dac_set_level.py so that running that file as a script does not
+give the helpers a second, unequal copy of the enums.
+
+spidev's xfer/xfer2 write the received bytes back into the list they are given.
+Data that is sent more than once is therefore kept as tuples (chunk() returns
+tuples) and each transfer is handed a fresh list(...) copy.
+
+Adam Stephen.
+"""
+
+import struct
+from enum import Enum
+
+"""-----------------------------------------------------------"""
+
+# spidev kernel module default buffer size (/sys/module/spidev/parameters/bufsiz) :
+# xfer/xfer2 reject larger transfers, xfer3 splits them itself
+SPIDEV_BUFSIZ = 4096
+
+
+class XferMode(Enum):
+    XFER1 = 1
+    XFER2 = 2
+    XFER3 = 3
+
+class WaveformPattern(Enum):
+    LEVELS = 1
+    RAMP = 2
+    SINE = 3
+    TRIANGULAR = 4
+
+
+def encode(values):
+    """DA2 frames : big endian 16 bit words as the byte list spidev expects."""
+    return list(struct.pack('>%dH' % len(values), *values))
+
+
+def chunk(buffer, size = SPIDEV_BUFSIZ):
+    """Split a byte list into transfers of at most size bytes, as tuples."""
+    return [tuple(buffer[i:i + size]) for i in range(0, len(buffer), size)]
+
+
+def sender(spi, mode):
+    """The spidev transfer method for an XferMode."""
+    if mode == XferMode.XFER1: return spi.xfer
+    if mode == XferMode.XFER2: return spi.xfer2
+    if mode == XferMode.XFER3: return spi.xfer3
+    raise ValueError('unknown transfer mode %r' % (mode,))
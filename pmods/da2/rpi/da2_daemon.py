@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Persistent DA2 daemon.
+
+Owns a single DA2/PmodSpiDev session and accepts commands over a Unix domain
+socket so that scripted level changes do not pay interpreter startup, imports
+and SPI open on every call.
+
+Line protocol (ASCII, one command per line, one reply line per command):
+
+    LEVEL <value>              set output level (stops any running stream)
+    WAVE <v0> <v1> ...         load a waveform for streaming
+    START [iterations] [mode]  stream the waveform (0 = forever, mode 1/2/3 = XferMode)
+    STOP                       stop streaming
+    STATS                      report counters (error=<reason> last if a stream failed)
+    PING
+
+Replies are "OK ..." or "ERR <reason>".  Clients may pipeline any number of
+commands : everything that arrives in one read is handled as a batch, runs of
+LEVEL commands in a batch go out as a single SPI transfer (split at the spidev
+buffer size for xfer/xfer2) and the replies are written back with a single send.
+
+Adam Stephen.
+"""
+
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from da2_common import XferMode, chunk, encode, sender
+from ut_dac_set_level import DA2
+
+"""-----------------------------------------------------------"""
+
+RECV_SIZE = 65536
+
+
+class DA2Daemon:
+    def __init__(self, socket_path, dac = None):
+        self.socket_path = socket_path
+        self.dac = dac if dac is not None else DA2()
+        self.lock = threading.Lock()
+        # serialises stop-then-start across client threads; never taken by the stream thread
+        self.stream_lock = threading.Lock()
+        self.stream_thread = None
+        self.stream_stop = threading.Event()
+        self.wave = None
+        self.stream_error = None
+        self.stats = dict(commands = 0, batches = 0, levels = 0, transfers = 0,
+                          bytes = 0, stream_iterations = 0)
+        self.started = time.monotonic()
+        self.server = None
+
+    # --- device access -----------------------------------------------------
+
+    def _send(self, buffer, mode = XferMode.XFER2):
+        """Caller holds self.lock."""
+        send = sender(self.dac.spi, mode)
+        # xfer3 splits long transfers itself
+        for c in [buffer] if mode == XferMode.XFER3 else chunk(buffer):
+            send(list(c))
+            self.stats['transfers'] += 1
+        self.stats['bytes'] += len(buffer)
+
+    def set_levels(self, values):
+        """Write one or more setpoints back to back, in as few transfers as bufsiz allows."""
+        self.stop_stream()
+        buffer = encode(values)
+        with self.lock:
+            self._send(buffer)
+            self.stats['levels'] += len(values)
+
+    def load_wave(self, values):
+        self.stop_stream()
+        with self.lock:
+            self.dac.set_levels(values)
+            self.wave = tuple(self.dac.buffer)
+
+    def start_stream(self, iterations = 0, mode = XferMode.XFER2):
+        with self.stream_lock:
+            if self.wave is None:
+                raise ValueError('no waveform loaded')
+            self._stop_stream()
+            self.stream_stop.clear()
+            self.stream_error = None
+            self.stream_thread = threading.Thread(target = self._stream,
+                                                  args = (iterations, mode),
+                                                  daemon = True)
+            self.stream_thread.start()
+
+    def _stream(self, iterations, mode):
+        i = 0
+        try:
+            while not self.stream_stop.is_set() and (iterations == 0 or i < iterations):
+                with self.lock:
+                    self._send(self.wave, mode)
+                    self.stats['stream_iterations'] += 1
+                i += 1
+        except Exception as e:
+            # the START reply has gone : kept for STATS
+            self.stream_error = '%s: %s' % (type(e).__name__, e)
+
+    def stop_stream(self):
+        with self.stream_lock:
+            self._stop_stream()
+
+    def _stop_stream(self):
+        """Caller holds self.stream_lock."""
+        if self.stream_thread is not None:
+            self.stream_stop.set()
+            self.stream_thread.join()
+            self.stream_thread = None
+
+    def streaming(self):
+        return self.stream_thread is not None and self.stream_thread.is_alive()
+
+    # --- protocol ------------------------------------------------------------
+
+    def handle_batch(self, lines):
+        """Execute a batch of command lines, return the list of reply lines."""
+        self.stats['batches'] += 1
+        replies = []
+        pending = []
+
+        def flush():
+            if pending:
+                self.set_levels(pending)
+                replies.extend(['OK'] * len(pending))
+                del pending[:]
+
+        for line in lines:
+            words = line.split()
+            if not words:
+                continue
+            self.stats['commands'] += 1
+            cmd = words[0].upper()
+            try:
+                if cmd == 'LEVEL':
+                    if len(words) != 2:
+                        raise ValueError('usage: LEVEL <value>')
+                    pending.append(parse_level(words[1]))
+                    continue
+                flush()
+                replies.append(self.handle_command(cmd, words[1:]))
+            except ValueError as e:
+                flush()
+                replies.append('ERR %s' % e)
+        flush()
+        return replies
+
+    def handle_command(self, cmd, args):
+        if cmd == 'WAVE':
+            if not args:
+                raise ValueError('usage: WAVE <v0> <v1> ...')
+            self.load_wave([parse_level(a) for a in args])
+            return 'OK %d' % len(args)
+        if cmd == 'START':
+            iterations = int(args[0]) if len(args) > 0 else 0
+            mode = XferMode(int(args[1])) if len(args) > 1 else XferMode.XFER2
+            self.start_stream(iterations, mode)
+            return 'OK'
+        if cmd == 'STOP':
+            self.stop_stream()
+            return 'OK'
+        if cmd == 'STATS':
+            fields = ['%s=%d' % kv for kv in self.stats.items()]
+            fields.append('streaming=%d' % self.streaming())
+            fields.append('uptime=%.3f' % (time.monotonic() - self.started))
+            if self.stream_error is not None:
+                fields.append('error=%s' % self.stream_error)
+            return 'OK ' + ' '.join(fields)
+        if cmd == 'PING':
+            return 'OK'
+        raise ValueError('unknown command %s' % cmd)
+
+    # --- server ----------------------------------------------------------------
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                pending = b''
+                while True:
+                    data = self.request.recv(RECV_SIZE)
+                    if not data:
+                        break
+                    pending += data
+                    *lines, pending = pending.split(b'\n')
+                    if not lines:
+                        continue
+                    # undecodable bytes become U+FFFD and fail parsing with an ERR reply
+                    replies = daemon.handle_batch([l.decode('ascii', errors = 'replace') for l in lines])
+                    if replies:
+                        self.request.sendall(('\n'.join(replies) + '\n').encode('ascii', errors = 'replace'))
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        print("DA2 daemon listening on %s" % self.socket_path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def close(self):
+        self.stop_stream()
+        if self.server is not None:
+            self.server.server_close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.dac.close()
+
+
+def parse_level(word):
+    value = int(word, 0)
+    if not 0 <= value <= 0xFFFF:
+        raise ValueError('level out of range %s' % word)
+    return value
+
+
+class DA2Client:
+    """Keeps one connection open; command() pipelines all its lines in one send."""
+    def __init__(self, socket_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.pending = b''
+
+    def command(self, *lines):
+        self.sock.sendall(('\n'.join(lines) + '\n').encode('ascii'))
+        expected = len([l for l in lines if l.split()])
+        replies = []
+        while len(replies) < expected:
+            while b'\n' not in self.pending:
+                data = self.sock.recv(RECV_SIZE)
+                if not data:
+                    raise ConnectionError('daemon closed the connection')
+                self.pending += data
+            line, self.pending = self.pending.split(b'\n', 1)
+            replies.append(line.decode('ascii'))
+        return replies
+
+    def set_level(self, value):
+        return self.command('LEVEL %d' % value)[0]
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
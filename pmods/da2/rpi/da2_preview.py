@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Waveform preview/export without hardware.
+
+Renders a waveform (DA2 sample codes), any iterable/generator of samples, or
+the payload of a recorded transfer trace to a self contained HTML page (inline
+SVG, no external scripts) or a PNG (needs matplotlib).  Millions of samples
+are reduced with a vectorised min/max envelope so that spikes survive the
+decimation, and the page documents the expected SCLK/MOSI/CS timing for the
+configured clock and transfer mode (the TODO in ut_dac_da2_xfer2.py).
+
+Adam Stephen.
+"""
+
+import html
+import itertools
+import math
+
+import numpy as np
+
+from da2_common import SPIDEV_BUFSIZ, XferMode, WaveformPattern
+
+"""-----------------------------------------------------------"""
+
+DAC_MAX = 4095
+BITS_PER_SAMPLE = 16
+ITER_CHUNK = 1 << 16
+
+# SPI mode -> (CPOL, CPHA)
+SPI_MODES = {0: (0, 0), 1: (0, 1), 2: (1, 0), 3: (1, 1)}
+
+
+def waveform(pattern, samples = 4096, periods = 1, low = 0, high = DAC_MAX, levels = None):
+    """Vectorised DA2 codes for a WaveformPattern."""
+    if pattern == WaveformPattern.LEVELS:
+        return np.repeat(np.asarray(levels, dtype = np.uint16), max(1, samples // len(levels)))
+    phase = (np.arange(samples) * periods / samples) % 1.0
+    if pattern == WaveformPattern.RAMP:
+        unit = phase
+    elif pattern == WaveformPattern.SINE:
+        unit = 0.5 - 0.5 * np.cos(2 * np.pi * phase)
+    elif pattern == WaveformPattern.TRIANGULAR:
+        unit = 1.0 - np.abs(2.0 * phase - 1.0)
+    else:
+        raise ValueError('unknown pattern %s' % pattern)
+    return np.rint(low + unit * (high - low)).astype(np.uint16)
+
+
+def to_array(samples):
+    """Accept arrays, lists or any iterable (e.g. a generator pipeline) of samples."""
+    if isinstance(samples, np.ndarray):
+        return samples
+    if isinstance(samples, (list, tuple, range)):
+        return np.asarray(samples)
+    it = iter(samples)
+    first = next(it, None)
+    if first is None:
+        return np.zeros(0)
+    if isinstance(first, np.ndarray):
+        # pipeline yielding blocks of samples
+        return np.concatenate([first] + list(it))
+    parts = [np.array([first], dtype = np.float64)]
+    while True:
+        part = np.fromiter(itertools.islice(it, ITER_CHUNK), dtype = np.float64)
+        if part.size == 0:
+            break
+        parts.append(part)
+    return np.concatenate(parts)
+
+
+def trace_samples(path):
+    """DA2 codes carried by a trace recorded with payloads (da2_trace.py)."""
+    from da2_trace import read_trace
+    header, records = read_trace(path)
+    payloads = [r[3] for r in records if r[1].startswith('xfer') or r[1].startswith('writebytes')]
+    if any(p is None for p in payloads):
+        raise ValueError('%s holds payload digests only : record with TraceWriter(payload = True) '
+                         '(daemon --trace-payload)' % path)
+    data = b''.join(payloads)
+    return np.frombuffer(data[:len(data) & ~1], dtype = '>u2').astype(np.uint16), header
+
+
+def envelope(samples, bins):
+    """
+    Min/max decimation : returns (x, lo, hi) with at most bins points, where x
+    is the index of the first sample in each bin.
+    """
+    samples = np.asarray(samples)
+    n = samples.size
+    if n <= bins:
+        x = np.arange(n)
+        return x, samples, samples
+    x = np.linspace(0, n, bins + 1).astype(np.int64)[:-1]
+    return x, np.minimum.reduceat(samples, x), np.maximum.reduceat(samples, x)
+
+
+def spi_timing(n_samples, spi_clock_speed, mode = XferMode.XFER2, spi_mode = 0b11, chunk_size = None):
+    """Expected bus timing for sending n_samples 16 bit frames."""
+    n_bytes = 2 * n_samples
+    if mode == XferMode.XFER1:
+        # xfer releases CS between every byte
+        per_cs = 1
+    else:
+        per_cs = min(chunk_size or n_bytes, SPIDEV_BUFSIZ) if n_bytes else 0
+    cs_frames = math.ceil(n_bytes / per_cs) if per_cs else 0
+    sclk_period = 1.0 / spi_clock_speed
+    cpol, cpha = SPI_MODES[spi_mode]
+    return dict(spi_clock_speed_hz = spi_clock_speed,
+                sclk_period_us = sclk_period * 1e6,
+                spi_mode = spi_mode,
+                sclk_idle = 'high' if cpol else 'low',
+                mosi_sampled_on = 'rising' if cpol == cpha else 'falling',
+                transfer_mode = mode.name,
+                samples = n_samples,
+                bytes = n_bytes,
+                cs_frames = cs_frames,
+                bytes_per_cs_frame = per_cs,
+                sample_period_us = BITS_PER_SAMPLE * sclk_period * 1e6,
+                max_sample_rate_hz = spi_clock_speed / BITS_PER_SAMPLE,
+                wire_time_s = n_bytes * 8 * sclk_period)
+
+
+def frame_signals(value, spi_mode = 0b11):
+    """
+    Half SCLK period resolution CS/SCLK/MOSI levels for one 16 bit frame,
+    with one idle half period either side.
+    """
+    cpol, cpha = SPI_MODES[spi_mode]
+    bits = [(value >> (15 - i)) & 1 for i in range(BITS_PER_SAMPLE)]
+    half = 2 * BITS_PER_SAMPLE
+    cs = [1] + [0] * half + [1]
+    if cpha == 0:
+        # data valid before the first (sampling) edge, mid bit
+        sclk = [cpol] + [cpol ^ (i % 2) for i in range(half)] + [cpol]
+        mosi = [bits[0]] + [bits[i // 2] for i in range(half)] + [bits[-1]]
+    else:
+        # data changes on the leading edge, sampled on the trailing edge
+        sclk = [cpol] + [cpol ^ ((i + 1) % 2) for i in range(half)] + [cpol]
+        mosi = [0] + [bits[i // 2] for i in range(half)] + [bits[-1]]
+    return dict(CS = cs, SCLK = sclk, MOSI = mosi)
+
+
+def _svg_polyline(points, colour):
+    return '<polyline fill="none" stroke="%s" stroke-width="1" points="%s"/>' % (
+        colour, ' '.join('%.1f,%.1f' % p for p in points))
+
+
+def envelope_svg(x, lo, hi, n, width = 1600, height = 400):
+    vmax = max(float(hi.max()) if hi.size else 1.0, 1.0)
+    xs = x * (width / max(n, 1))
+    ylo = height - lo.astype(np.float64) * (height / vmax)
+    yhi = height - hi.astype(np.float64) * (height / vmax)
+    band = np.concatenate([np.column_stack([xs, yhi]), np.column_stack([xs, ylo])[::-1]])
+    polygon = '<polygon fill="#4a7ebb" fill-opacity="0.5" stroke="#2a5e9b" stroke-width="1" points="%s"/>' % (
+        ' '.join('%.1f,%.1f' % tuple(p) for p in band))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+            'style="background:#fff;border:1px solid #ccc">%s</svg>' % (width, height, polygon))
+
+
+def timing_svg(signals, width = 800, row = 40):
+    names = list(signals)
+    steps = len(signals[names[0]])
+    dx = (width - 60) / steps
+    parts = []
+    for r, name in enumerate(names):
+        top = r * row + 10
+        points = []
+        for i, level in enumerate(signals[name]):
+            y = top + (0 if level else row - 15)
+            points.extend([(60 + i * dx, y), (60 + (i + 1) * dx, y)])
+        parts.append('<text x="5" y="%d" font-family="monospace" font-size="12">%s</text>' % (top + 15, name))
+        parts.append(_svg_polyline(points, '#333'))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">%s</svg>' %
+            (width, row * len(names) + 10, ''.join(parts)))
+
+
+def render_html(path, samples, timing, title = 'DA2 waveform preview', width = 1600):
+    samples = to_array(samples)
+    x, lo, hi = envelope(samples, width)
+    first = int(samples[0]) if samples.size else 0
+    rows = ''.join('<tr><td>%s</td><td>%s</td></tr>' % (html.escape(k),
+                   ('%.6g' % v) if isinstance(v, float) else html.escape(str(v)))
+                   for k, v in timing.items())
+    page = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s</title></head>'
+            '<body style="font-family:sans-serif"><h2>%s</h2>'
+            '<p>%d samples, min %d, max %d (min/max envelope over %d bins)</p>%s'
+            '<h3>Bus timing</h3><table border="1" cellpadding="3" style="border-collapse:collapse">%s</table>'
+            '<h3>First frame (0x%04x)</h3>%s</body></html>') % (
+        html.escape(title), html.escape(title), samples.size,
+        int(samples.min()) if samples.size else 0, int(samples.max()) if samples.size else 0,
+        lo.size, envelope_svg(x, lo, hi, samples.size, width), rows,
+        first, timing_svg(frame_signals(first, timing['spi_mode'])))
+    with open(path, 'w') as f:
+        f.write(page)
+
+
+def render_png(path, samples, timing, title = 'DA2 waveform preview', width = 1600):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    samples = to_array(samples)
+    x, lo, hi = envelope(samples, width)
+    first = int(samples[0]) if samples.size else 0
+    signals = frame_signals(first, timing['spi_mode'])
+    fig, (ax, bx) = plt.subplots(2, 1, figsize = (width / 100, 8),
+                                 gridspec_kw = dict(height_ratios = [3, 1]))
+    ax.fill_between(x, lo, hi, step = 'post', linewidth = 0.5)
+    ax.set_title('%s : %d samples, %.0f Hz max sample rate, %s' % (
+        title, samples.size, timing['max_sample_rate_hz'], timing['transfer_mode']))
+    for r, name in enumerate(signals):
+        bx.step(np.arange(len(signals[name])), np.asarray(signals[name]) * 0.8 + 2 * r,
+                where = 'post')
+    bx.set_yticks([2 * r + 0.4 for r in range(len(signals))])
+    bx.set_yticklabels(list(signals))
+    bx.set_xlabel('half SCLK periods (%.3g us)' % (timing['sclk_period_us'] / 2))
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def render(path, samples, timing, title = 'DA2 waveform preview', width = 1600):
+    if path.lower().endswith('.png'):
+        render_png(path, samples, timing, title, width)
+    else:
+        render_html(path, samples, timing, title, width)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Streaming sample rate conversion for DA2 playback.
+
+Source traces come at rates unrelated to what the DA2 achieves for a given
+spi_clock_speed and XferMode.  The resamplers here convert chunk by chunk,
+carrying their state across chunks, so arbitrarily long files convert in
+bounded memory.  Both kernels are vectorised per chunk.
+
+The conversion ratio is approximated by a fraction.  The smallest denominator
+giving a rate within max_error_ppm of the one asked for is used (ValueError if
+max_denominator cannot achieve it) and the resulting error is kept in
+rate_error_ppm.  Output positions are then exact integer arithmetic, so the
+output does not drift further over long files and chunking does not change it.
+
+    LinearResampler    : linear interpolation, cheap, no anti-alias filtering
+    PolyphaseResampler : rational L/M polyphase FIR (Kaiser windowed sinc), each
+                         phase normalised to unit DC gain; delays the output by
+                         about taps / 2 input samples
+
+achievable_rate() measures the sample rate the DAC actually sustains.
+
+Adam Stephen.
+"""
+
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from da2_common import XferMode, encode, sender
+
+"""-----------------------------------------------------------"""
+
+DAC_MAX = 4095
+BITS_PER_SAMPLE = 16
+CHUNK = 1 << 16
+MAX_DENOMINATOR = 10000
+MAX_RATE_ERROR_PPM = 1.0
+
+
+def achievable_rate(dac, mode = XferMode.XFER2, samples = 2048, repeats = 5):
+    """Measured samples per second for back to back transfers of a block."""
+    block = encode([0] * samples)
+    send = sender(dac.spi, mode)
+    send(list(block))
+    start = time.perf_counter()
+    for i in range(repeats):
+        send(list(block))
+    elapsed = time.perf_counter() - start
+    nominal = dac.spi.max_speed_hz / BITS_PER_SAMPLE
+    return min(samples * repeats / elapsed, nominal) if elapsed > 0 else nominal
+
+
+def rational(ratio, max_error_ppm = MAX_RATE_ERROR_PPM, max_denominator = MAX_DENOMINATOR):
+    """(p, q) with the smallest q <= max_denominator such that p/q is within max_error_ppm of ratio."""
+    target = Fraction(ratio)
+    d = 10
+    while True:
+        d = min(d, max_denominator)
+        f = target.limit_denominator(d)
+        error_ppm = abs(float(f / target) - 1.0) * 1e6
+        if error_ppm <= max_error_ppm:
+            return f.numerator, f.denominator
+        if d == max_denominator:
+            raise ValueError('ratio %r : best fraction with denominator <= %d (%d/%d) is %.3f ppm off, '
+                             'max_error_ppm is %g' % (ratio, max_denominator, f.numerator,
+                                                      f.denominator, error_ppm, max_error_ppm))
+        d *= 10
+
+
+class LinearResampler:
+    def __init__(self, src_rate, dst_rate, max_error_ppm = MAX_RATE_ERROR_PPM,
+                 max_denominator = 1000000):
+        # input position of output n is n * a / b
+        self.a, self.b = rational(src_rate / dst_rate, max_error_ppm, max_denominator)
+        self.rate_error_ppm = (src_rate * self.b / (self.a * dst_rate) - 1.0) * 1e6
+        self.n = 0            # next output index
+        self.consumed = 0     # inputs seen so far
+        self.last = None      # final input sample of the previous chunk
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype = np.float64)
+        if chunk.size == 0:
+            return chunk
+        if self.last is None:
+            buf = chunk
+            base = 0
+        else:
+            buf = np.concatenate([[self.last], chunk])
+            base = self.consumed - 1
+        self.consumed += chunk.size
+        self.last = chunk[-1]
+        top = self.consumed - 1
+        # outputs whose left neighbour is strictly before the final input
+        count = (top * self.b + self.a - 1) // self.a - self.n
+        if count <= 0:
+            return np.zeros(0)
+        num = (self.n + np.arange(count, dtype = np.int64)) * self.a
+        idx = num // self.b - base
+        frac = (num % self.b) / self.b
+        self.n += count
+        return buf[idx] + frac * (buf[idx + 1] - buf[idx])
+
+    def flush(self):
+        """An output landing exactly on the final input, if there is one."""
+        if self.last is None or (self.n * self.a) != (self.consumed - 1) * self.b:
+            return np.zeros(0)
+        self.n += 1
+        return np.array([self.last])
+
+
+class PolyphaseResampler:
+    def __init__(self, src_rate, dst_rate, taps_per_phase = 16, beta = 8.0,
+                 max_error_ppm = MAX_RATE_ERROR_PPM, max_denominator = MAX_DENOMINATOR):
+        """taps_per_phase : filter length in periods of the slower of the two rates"""
+        self.up, self.down = rational(dst_rate / src_rate, max_error_ppm, max_denominator)
+        self.rate_error_ppm = (src_rate * self.up / (self.down * dst_rate) - 1.0) * 1e6
+        L = self.up
+        # the sinc spans taps_per_phase * max(L, M) samples at the L times upsampled
+        # rate : when decimating that is more than taps_per_phase inputs per phase
+        K = -(-taps_per_phase * max(L, self.down) // L)
+        n = L * K
+        cutoff = 1.0 / max(L, self.down)
+        t = np.arange(n) - (n - 1) / 2.0
+        h = np.sinc(cutoff * t) * np.kaiser(n, beta)
+        # phases[p, k] = h[p + k * L]
+        self.phases = h.reshape(K, L).T.copy()
+        self.phases /= self.phases.sum(axis = 1, keepdims = True)
+        self.taps = K
+        self.history = np.zeros(K - 1)
+        self.m = 0            # next output index
+        self.consumed = 0
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype = np.float64)
+        if chunk.size == 0:
+            return chunk
+        buf = np.concatenate([self.history, chunk])
+        base = self.consumed - (self.taps - 1)
+        self.consumed += chunk.size
+        self.history = buf[buf.size - (self.taps - 1):] if self.taps > 1 else np.zeros(0)
+        top = self.consumed - 1
+        count = ((top + 1) * self.up + self.down - 1) // self.down - self.m
+        if count <= 0:
+            return np.zeros(0)
+        j = (self.m + np.arange(count, dtype = np.int64)) * self.down
+        centre = j // self.up - base
+        windows = buf[centre[:, None] - np.arange(self.taps)[None, :]]
+        self.m += count
+        return np.einsum('nk,nk->n', self.phases[j % self.up], windows)
+
+    def flush(self):
+        """Final call : push zeros through so the filter delay drains."""
+        pad = self.taps // 2
+        out = self.process(np.zeros(pad))
+        self.consumed -= pad
+        return out
+
+
+RESAMPLERS = {'linear': LinearResampler, 'polyphase': PolyphaseResampler}
+
+
+def to_codes(samples, gain = 1.0, offset = 0.0):
+    """Scale, round and clip to DA2 codes."""
+    return np.clip(np.rint(np.asarray(samples) * gain + offset), 0, DAC_MAX).astype(np.uint16)
+
+
+def resample_stream(chunks, resampler):
+    """Pipeline stage : yields resampled blocks for an iterable of input blocks."""
+    for chunk in chunks:
+        out = resampler.process(chunk)
+        if out.size:
+            yield out
+    out = resampler.flush()
+    if out.size:
+        yield out
+
+
+def read_chunks(path, dtype = np.int16, chunk = CHUNK):
+    """Blocks of a .npy file or a raw binary file, memory mapped."""
+    if path.endswith('.npy'):
+        data = np.load(path, mmap_mode = 'r')
+    else:
+        data = np.memmap(path, dtype = dtype, mode = 'r')
+    for i in range(0, data.shape[0], chunk):
+        yield np.asarray(data[i:i + chunk], dtype = np.float64)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Watchdog and safe state supervisor for continuous DA2 output.
+
+The writer thread streams preencoded chunks and leaves a heartbeat after each
+transfer (two integer increments, no clock read, no lock).  A monitor thread
+samples the heartbeat counters and trips on
+
+    stall    : no transfer completed for stall_timeout seconds
+    collapse : throughput over the last window below min_throughput bytes/s
+    error    : the writer raised
+    signal   : SIGINT/SIGTERM
+
+On a trip the preencoded safe level frame is pushed straight away from the
+tripping thread (it does not wait for a possibly hung writer), the writer is
+told to stop, and once it has finished its in-flight transfer the safe frame
+is sent again so the writer cannot leave the last word.  stop() is the clean
+shutdown path and ends in the same safe state.
+
+measure_overhead() compares supervised and bare streaming throughput.
+
+Adam Stephen.
+"""
+
+import signal
+import threading
+import time
+
+from da2_common import XferMode, chunk, encode, sender
+
+"""-----------------------------------------------------------"""
+
+class Supervisor:
+    def __init__(self, dac, safe_level = 0, stall_timeout = 0.5, min_throughput = 0,
+                 window = 1.0, check_interval = 0.05, mode = XferMode.XFER2):
+        self.dac = dac
+        self.mode = mode
+        self.send = sender(dac.spi, mode)
+        # xfer2 holds CS for the whole 16 bit frame whatever the streaming mode
+        self.safe_send = dac.spi.xfer2
+        self.safe_frame = tuple(encode([safe_level]))
+        self.stall_timeout = stall_timeout
+        self.min_throughput = min_throughput
+        self.window = window
+        self.check_interval = check_interval
+        self.beats = 0
+        self.bytes = 0
+        self.stopping = False
+        self.fault = None
+        # re-entrant : a signal may land while the main thread is inside trip()
+        self.trip_lock = threading.RLock()
+        self.tripped = threading.Event()
+        self.safe_latency_ns = None
+        self.started = time.monotonic()
+        self.writer = None
+        self.monitor = None
+        self.previous_handlers = {}
+
+    # --- writer ----------------------------------------------------------------
+
+    def _write(self, chunks, iterations):
+        send = self.send
+        try:
+            i = 0
+            while not self.stopping and (iterations == 0 or i < iterations):
+                for c in chunks:
+                    if self.stopping:
+                        break
+                    send(list(c))
+                    self.beats += 1
+                    self.bytes += len(c)
+                i += 1
+        except Exception as e:
+            self.trip('error %s' % e)
+            return
+        if not self.stopping:
+            self.trip(None)
+
+    # --- monitor ---------------------------------------------------------------
+
+    def _monitor(self):
+        clock = time.monotonic
+        last_beats = self.beats
+        last_change = clock()
+        samples = [(last_change, self.bytes)]
+        while not self.tripped.wait(self.check_interval):
+            now = clock()
+            beats = self.beats
+            if beats != last_beats:
+                last_beats = beats
+                last_change = now
+            elif now - last_change > self.stall_timeout:
+                self.trip('stall %.3f s' % (now - last_change))
+                return
+            samples.append((now, self.bytes))
+            while now - samples[0][0] > self.window:
+                oldest = samples.pop(0)
+                rate = (self.bytes - oldest[1]) / (now - oldest[0])
+                if self.min_throughput and rate < self.min_throughput:
+                    self.trip('collapse %.0f B/s' % rate)
+                    return
+
+    # --- control ---------------------------------------------------------------
+
+    def start(self, chunks, iterations = 0, handle_signals = True):
+        """Stream chunks (byte lists) iterations times (0 = until stopped)."""
+        if handle_signals and threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self.previous_handlers[signum] = signal.signal(signum, self._on_signal)
+        self.writer = threading.Thread(target = self._write, args = (chunks, iterations),
+                                       daemon = True)
+        self.monitor = threading.Thread(target = self._monitor, daemon = True)
+        self.started = time.monotonic()
+        self.writer.start()
+        self.monitor.start()
+
+    def _on_signal(self, signum, frame):
+        self.trip('signal %d' % signum)
+
+    def trip(self, reason):
+        """Drive the safe level now; reason None is a normal end of stream."""
+        with self.trip_lock:
+            if self.tripped.is_set():
+                return
+            t = time.monotonic_ns()
+            self.stopping = True
+            self.safe_send(list(self.safe_frame))
+            self.safe_latency_ns = time.monotonic_ns() - t
+            self.fault = reason
+            self.tripped.set()
+
+    def wait(self, timeout = None):
+        """Wait for a trip (fault, signal or end of stream); True if tripped."""
+        return self.tripped.wait(timeout)
+
+    def stop(self, join_timeout = 1.0):
+        """Clean shutdown : stop the writer and leave the output at the safe level."""
+        self.trip(self.fault)
+        if self.writer is not None and self.writer is not threading.current_thread():
+            self.writer.join(join_timeout)
+        if self.writer is None or not self.writer.is_alive():
+            # the writer's in-flight transfer may have landed after the first safe frame
+            self.safe_send(list(self.safe_frame))
+        if self.monitor is not None:
+            self.monitor.join(join_timeout)
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = {}
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        return dict(fault = self.fault,
+                    transfers = self.beats,
+                    bytes = self.bytes,
+                    throughput_Bps = self.bytes / elapsed if elapsed > 0 else 0.0,
+                    safe_frame_us = self.safe_latency_ns / 1e3 if self.safe_latency_ns else None)
+
+
+def measure_overhead(dac, chunks, iterations = 20, trials = 3, mode = XferMode.XFER2):
+    """
+    Best of trials throughput for a bare loop and for the same loop under a
+    Supervisor; returns (bare B/s, supervised B/s, overhead percent).
+    """
+    send = sender(dac.spi, mode)
+    total = iterations * sum(len(c) for c in chunks)
+    bare = []
+    supervised = []
+    for trial in range(trials):
+        start = time.perf_counter()
+        for i in range(iterations):
+            for c in chunks:
+                send(list(c))
+        bare.append(total / (time.perf_counter() - start))
+        sup = Supervisor(dac, mode = mode, stall_timeout = 10.0)
+        start = time.perf_counter()
+        sup.start(chunks, iterations, handle_signals = False)
+        sup.writer.join()
+        supervised.append(total / (time.perf_counter() - start))
+        sup.stop()
+    bare_rate = max(bare)
+    supervised_rate = max(supervised)
+    return bare_rate, supervised_rate, 100.0 * (1.0 - supervised_rate / bare_rate)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Synchronised playback across several DA2 modules on one monotonic timeline.
+
+Block k of every device is due at t0 + k * block_period.  Each SPI bus gets a
+worker thread; buses run in parallel.  On a shared bus transfers are
+serialised, so rather than sending each device's whole block in turn (skew of
+a full block) the block is cut into slices that are interleaved round robin
+across the devices : the skew on a bus is bounded by one slice.
+
+Completion of each device's first slice (its first samples are then on the
+DAC) is timestamped against the deadline.  After every block the inter-device
+skew is recorded and each bus's start offset is nudged towards the common
+mean, compensating the next block for thread wake up and bus differences.
+
+If a bus worker fails (a send raising, a source raising) it aborts the block
+barrier so the other workers stop too, and play() re-raises its exception.
+
+Adam Stephen.
+"""
+
+import statistics
+import threading
+import time
+
+from da2_common import XferMode, encode, sender
+
+"""-----------------------------------------------------------"""
+
+SPIN_NS = 200000
+
+
+def wait_until(deadline, clock = time.monotonic_ns):
+    """Sleep most of the way, then spin for the last SPIN_NS."""
+    remaining = deadline - clock()
+    if remaining > SPIN_NS:
+        time.sleep((remaining - SPIN_NS) / 1e9)
+    while clock() < deadline:
+        pass
+
+
+class Timeline:
+    def __init__(self, block_period, slice_samples = 32, gain = 0.5, mode = XferMode.XFER2):
+        self.block_period_ns = int(block_period * 1e9)
+        self.slice_bytes = 2 * slice_samples
+        self.gain = gain
+        self.mode = mode
+        self.devices = {}
+        self.buses = {}
+        self.bus_offset = {}
+        self.clock = time.monotonic_ns
+        self.blocks = []
+
+    def add(self, name, dac, bus = None):
+        """bus defaults to the SPI port : devices on one port share SCLK/MOSI."""
+        if bus is None:
+            bus = dac.pmod.SPI_port
+        self.devices[name] = dict(dac = dac, bus = bus, send = sender(dac.spi, self.mode))
+        self.buses.setdefault(bus, []).append(name)
+        self.bus_offset[bus] = 0
+
+    def slices(self, values):
+        buffer = encode(values)
+        n = self.slice_bytes
+        return [buffer[i:i + n] for i in range(0, len(buffer), n)]
+
+    def play(self, blocks, count, start_delay = 0.01):
+        """
+        blocks : name -> iterable of sample blocks.  Plays count blocks (or until
+        an iterable runs out) and returns the per block reports.
+        """
+        sources = dict((name, iter(blocks[name])) for name in self.devices)
+        self.t0 = self.clock() + int(start_delay * 1e9)
+        self.stop = False
+        self.exhausted = False
+        self.first = {}
+        self.done = {}
+        self.k = 0
+        self.error = None
+        barrier = threading.Barrier(len(self.buses), action = self._end_block)
+        workers = [threading.Thread(target = self._worker,
+                                    args = (bus, sources, count, barrier), daemon = True)
+                   for bus in self.buses]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        if self.error is not None:
+            raise self.error
+        return self.blocks
+
+    def _worker(self, bus, sources, count, barrier):
+        try:
+            self._play_bus(bus, sources, count, barrier)
+        except threading.BrokenBarrierError:
+            # another worker failed and aborted the barrier : play() raises its error
+            pass
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+            self.stop = True
+            barrier.abort()
+
+    def _play_bus(self, bus, sources, count, barrier):
+        names = self.buses[bus]
+        sends = [self.devices[name]['send'] for name in names]
+        clock = self.clock
+        for k in range(count):
+            try:
+                prepared = [self.slices(next(sources[name])) for name in names]
+            except StopIteration:
+                self.exhausted = True
+                prepared = None
+            if prepared is not None and not self.exhausted:
+                deadline = self.t0 + k * self.block_period_ns
+                wait_until(deadline + self.bus_offset[bus], clock)
+                for s in range(max(len(p) for p in prepared)):
+                    for name, send, p in zip(names, sends, prepared):
+                        if s < len(p):
+                            send(p[s])
+                            if s == 0:
+                                self.first[name] = clock() - deadline
+                self.done[bus] = clock() - deadline
+            barrier.wait()
+            if self.stop:
+                break
+
+    def _end_block(self):
+        """Runs once per block, after every bus has finished it."""
+        # stop is only set here, while every worker is at the barrier, so they
+        # all see it after the same block
+        if self.exhausted:
+            self.stop = True
+            return
+        if len(self.first) != len(self.devices):
+            return
+        first = dict(self.first)
+        mean = statistics.mean(first.values())
+        report = dict(block = self.k,
+                      skew_ns = max(first.values()) - min(first.values()),
+                      lag_ns = first,
+                      late = max(self.done.values()) > self.block_period_ns,
+                      bus_offset_ns = dict(self.bus_offset))
+        self.blocks.append(report)
+        # compensate : move each bus's start towards the mean first slice time
+        for bus, names in self.buses.items():
+            err = statistics.mean(first[name] for name in names) - mean
+            self.bus_offset[bus] -= int(self.gain * err)
+        low = min(self.bus_offset.values())
+        for bus in self.bus_offset:
+            self.bus_offset[bus] -= low
+        self.first.clear()
+        self.k += 1
+
+
+def skew_summary(reports, skip = 0):
+    """Skew statistics in microseconds over the reports after the first skip blocks."""
+    skews = sorted(r['skew_ns'] / 1e3 for r in reports[skip:])
+    if not skews:
+        return dict(blocks = 0)
+    return dict(blocks = len(skews),
+                skew_us_mean = statistics.mean(skews),
+                skew_us_p99 = skews[min(len(skews) - 1, int(0.99 * len(skews)))],
+                skew_us_max = skews[-1],
+                late_blocks = sum(1 for r in reports[skip:] if r['late']))
+
+
+def recorded_skew(devices, slices_per_block):
+    """
+    Skew per block from recording backends (FakeSpiDev.transfers timestamps, taken
+    as each transfer is issued) : independent of the coordinator's own timestamps.
+    """
+    starts = [[t for t, method, payload in list(dac.spi.transfers)[::slices_per_block]]
+              for dac in devices]
+    n = min(len(s) for s in starts)
+    return [max(s[k] for s in starts) - min(s[k] for s in starts) for k in range(n)]
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Record/replay of SPI transfer traces.
+
+PmodSpiDev(trace = TraceWriter(path)) records every transfer made through the
+spidev handle.  The caller only timestamps and copies the payload onto a queue;
+hashing, packing and the (buffered) file writes happen on a background thread.
+
+File format (little endian):
+
+    header : magic 'DA2T', u8 version, u8 flags, u32 max_speed_hz, u8 spi_mode
+    record : u64 CLOCK_MONOTONIC ns, u8 method, u32 length,
+             then the payload (FLAG_PAYLOAD) or its 8 byte blake2b digest
+
+Method codes 1..3 are the XferMode values (xfer, xfer2, xfer3).
+
+replay() re-drives a trace against a fake backend, either on the original
+schedule or as fast as possible, and reports throughput and jitter so that
+traces recorded with different code versions can be compared.
+
+Adam Stephen.
+"""
+
+import hashlib
+import queue
+import statistics
+import struct
+import threading
+import time
+import warnings
+
+from fake_spidev import FakeSpiDev
+
+"""-----------------------------------------------------------"""
+
+MAGIC = b'DA2T'
+VERSION = 1
+FLAG_PAYLOAD = 0x01
+HEADER = struct.Struct('<4sBBIB')
+RECORD = struct.Struct('<QBI')
+DIGEST_SIZE = 8
+
+METHODS = {'xfer': 1, 'xfer2': 2, 'xfer3': 3, 'writebytes': 4, 'writebytes2': 5}
+METHOD_NAMES = dict((v, k) for k, v in METHODS.items())
+
+WRITE_BUFFER = 1 << 16
+
+
+class TraceWriter:
+    def __init__(self, path, payload = False):
+        """payload : store full payloads (replayable byte for byte) rather than digests"""
+        self.path = path
+        self.payload = payload
+        self.queue = queue.SimpleQueue()
+        self.header_written = False
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def header(self, max_speed_hz, spi_mode):
+        self.queue.put(('header', max_speed_hz, spi_mode))
+
+    def record(self, method, values):
+        self.queue.put((time.monotonic_ns(), METHODS[method], bytes(values)))
+
+    def _run(self):
+        flags = FLAG_PAYLOAD if self.payload else 0
+        with open(self.path, 'wb', buffering = WRITE_BUFFER) as f:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                if item[0] == 'header':
+                    f.write(HEADER.pack(MAGIC, VERSION, flags, item[1], item[2]))
+                    self.header_written = True
+                    continue
+                if not self.header_written:
+                    f.write(HEADER.pack(MAGIC, VERSION, flags, 0, 0))
+                    self.header_written = True
+                t, code, data = item
+                f.write(RECORD.pack(t, code, len(data)))
+                if self.payload:
+                    f.write(data)
+                else:
+                    f.write(hashlib.blake2b(data, digest_size = DIGEST_SIZE).digest())
+
+    def close(self):
+        """Drain the queue and close the file."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+class TracingSpiDev:
+    """Wraps a spidev handle, recording transfers to a TraceWriter."""
+    def __init__(self, spi, writer):
+        object.__setattr__(self, 'spi', spi)
+        object.__setattr__(self, 'writer', writer)
+        writer.header(spi.max_speed_hz, spi.mode)
+
+    def __getattr__(self, name):
+        return getattr(self.spi, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.spi, name, value)
+
+    def xfer(self, values, *args):
+        self.writer.record('xfer', values)
+        return self.spi.xfer(values, *args)
+
+    def xfer2(self, values, *args):
+        self.writer.record('xfer2', values)
+        return self.spi.xfer2(values, *args)
+
+    def xfer3(self, values, *args):
+        self.writer.record('xfer3', values)
+        return self.spi.xfer3(values, *args)
+
+    def writebytes(self, values):
+        self.writer.record('writebytes', values)
+        return self.spi.writebytes(values)
+
+    def writebytes2(self, values):
+        self.writer.record('writebytes2', values)
+        return self.spi.writebytes2(values)
+
+
+def read_trace(path):
+    """
+    Return (header dict, list of (t_ns, method, length, payload or None, digest)).
+    A partial final record (recording cut short) is dropped with a warning.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, flags, max_speed_hz, spi_mode = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a version %d DA2 trace' % (path, VERSION))
+    header = dict(flags = flags, max_speed_hz = max_speed_hz, spi_mode = spi_mode)
+    records = []
+    offset = HEADER.size
+    while offset < len(data):
+        if offset + RECORD.size > len(data):
+            break
+        t, code, length = RECORD.unpack_from(data, offset)
+        if offset + RECORD.size + (length if flags & FLAG_PAYLOAD else DIGEST_SIZE) > len(data):
+            break
+        offset += RECORD.size
+        if flags & FLAG_PAYLOAD:
+            payload = data[offset:offset + length]
+            digest = hashlib.blake2b(payload, digest_size = DIGEST_SIZE).digest()
+            offset += length
+        else:
+            payload = None
+            digest = data[offset:offset + DIGEST_SIZE]
+            offset += DIGEST_SIZE
+        records.append((t, METHOD_NAMES[code], length, payload, digest))
+    if offset < len(data):
+        warnings.warn('%s: ignoring %d byte partial record at the end of the trace'
+                      % (path, len(data) - offset))
+    return header, records
+
+
+def timing_stats(timestamps, lengths):
+    """Throughput and inter-transfer jitter for a series of transfers."""
+    n = len(timestamps)
+    total = sum(lengths)
+    duration = (timestamps[-1] - timestamps[0]) / 1e9 if n > 1 else 0.0
+    intervals = [(b - a) / 1e3 for a, b in zip(timestamps, timestamps[1:])]
+    stats = dict(transfers = n, bytes = total, duration_s = duration,
+                 throughput_Bps = total / duration if duration > 0 else 0.0)
+    if intervals:
+        stats['interval_us_mean'] = statistics.mean(intervals)
+        stats['jitter_us'] = statistics.pstdev(intervals)
+        stats['interval_us_max'] = max(intervals)
+    return stats
+
+
+def replay(path, max_speed = False, backend = FakeSpiDev, simulate_timing = True):
+    """
+    Re-drive a trace against backend.  On the original schedule (max_speed False)
+    the stats also include the schedule error of each transfer.
+    Digest only traces are replayed with zero filled payloads of the same length.
+    """
+    header, records = read_trace(path)
+    spi = backend()
+    spi.max_speed_hz = header['max_speed_hz'] or spi.max_speed_hz
+    spi.mode = header['spi_mode']
+    if hasattr(spi, 'simulate_timing'):
+        spi.simulate_timing = simulate_timing
+    payloads = [r[3] if r[3] is not None else bytes(r[2]) for r in records]
+    methods = [getattr(spi, r[1]) for r in records]
+    clock = time.monotonic_ns
+    t_first = records[0][0] if records else 0
+    issued = []
+    errors = []
+    start = clock()
+    for (t, method, length, payload, digest), send, data in zip(records, methods, payloads):
+        if not max_speed:
+            due = start + (t - t_first)
+            remaining = due - clock()
+            if remaining > 1000000:
+                time.sleep((remaining - 500000) / 1e9)
+            while clock() < due:
+                pass
+        now = clock()
+        send(list(data))
+        issued.append(now)
+        if not max_speed:
+            errors.append((now - due) / 1e3)
+    spi.close()
+    stats = timing_stats(issued, [r[2] for r in records])
+    if errors:
+        stats['schedule_error_us_mean'] = statistics.mean(errors)
+        stats['schedule_error_us_max'] = max(errors)
+    return stats
+
+
+def recorded_stats(path):
+    header, records = read_trace(path)
+    return timing_stats([r[0] for r in records], [r[2] for r in records])
+
+
+def compare(a, b):
+    """Side by side stats, with b/a ratios."""
+    rows = []
+    for k in a:
+        if k in b:
+            ratio = b[k] / a[k] if a[k] else float('nan')
+            rows.append((k, a[k], b[k], ratio))
+    return rows
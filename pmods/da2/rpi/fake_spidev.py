@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Fake spidev.SpiDev backend for developing the Pmod drivers away from the Raspberry Pi.
+
+Implements the subset of the spidev API used by PmodSpiDev/DA2 and records every
+transfer (monotonic timestamp, method name, payload bytes).
+
+Return values follow py-spidev : xfer/xfer2 write the received bytes back into
+the list they were given and return that same list, xfer3 returns a tuple.
+MISO floats high (0xFF) as on the DA2, which has no data output, unless
+loopback is set, in which case received bytes are the transmitted bytes as if
+MOSI were jumpered onto MISO.  Setting max_reliable_hz corrupts the loopback
+above that clock, standing in for wiring that cannot run at the requested speed.
+As in py-spidev, xfer/xfer2/writebytes raise OverflowError for more than bufsiz
+bytes.
+
+Adam Stephen.
+"""
+
+import time
+from collections import deque
+
+from da2_common import SPIDEV_BUFSIZ
+
+"""-----------------------------------------------------------"""
+
+
+class FakeSpiDev:
+    def __init__(self,
+                bus = None,
+                device = None,
+                simulate_timing = False,
+                max_records = None,
+                max_reliable_hz = None,
+                loopback = False):
+        """
+        simulate_timing : sleep for the time the bytes would take on the wire
+        max_records : bound the transfer record (None = keep everything)
+        max_reliable_hz : loopback data is corrupted above this clock (None = never)
+        loopback : read back the transmitted bytes rather than 0xFF
+        """
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.bits_per_word = 8
+        self.bufsiz = SPIDEV_BUFSIZ
+        self.simulate_timing = simulate_timing
+        self.max_reliable_hz = max_reliable_hz
+        self.loopback = loopback
+        self.transfers = deque(maxlen = max_records)
+        self.bytes_sent = 0
+        self.bus = None
+        self.device = None
+        if bus is not None:
+            self.open(bus, device)
+
+    def open(self, bus, device):
+        self.bus = bus
+        self.device = device
+
+    def close(self):
+        self.bus = None
+        self.device = None
+
+    def _record(self, method, values):
+        t = time.monotonic_ns()
+        payload = bytes(values)
+        self.transfers.append((t, method, payload))
+        self.bytes_sent += len(payload)
+        if self.simulate_timing and self.max_speed_hz > 0:
+            time.sleep(len(payload) * self.bits_per_word / self.max_speed_hz)
+        return payload
+
+    def _check_size(self, values):
+        if len(values) > self.bufsiz:
+            raise OverflowError('Argument list size exceeds %d bytes.' % self.bufsiz)
+
+    def _received(self, payload):
+        if not self.loopback:
+            return [0xFF] * len(payload)
+        rx = list(payload)
+        if self.max_reliable_hz is not None and self.max_speed_hz > self.max_reliable_hz:
+            for i in range(0, len(rx), 97):
+                rx[i] ^= 0x01
+        return rx
+
+    def _in_place(self, values, rx):
+        """As py-spidev : rx replaces the contents of a list argument, which is returned."""
+        if isinstance(values, list):
+            values[:] = rx
+            return values
+        return rx
+
+    def xfer(self, values, speed_hz = 0, delay_usecs = 0, bits_per_word = 0):
+        self._check_size(values)
+        return self._in_place(values, self._received(self._record('xfer', values)))
+
+    def xfer2(self, values, speed_hz = 0, delay_usecs = 0, bits_per_word = 0):
+        self._check_size(values)
+        return self._in_place(values, self._received(self._record('xfer2', values)))
+
+    def xfer3(self, values, speed_hz = 0, delay_usecs = 0, bits_per_word = 0):
+        return tuple(self._received(self._record('xfer3', values)))
+
+    def writebytes(self, values):
+        self._check_size(values)
+        self._record('writebytes', values)
+
+    def writebytes2(self, values):
+        self._record('writebytes2', values)
+
+    def readbytes(self, n):
+        return [0] * n
+
+    def reset(self):
+        """Forget recorded transfers."""
+        self.transfers.clear()
+        self.bytes_sent = 0
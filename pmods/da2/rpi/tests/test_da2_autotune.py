@@ -0,0 +1,56 @@
+import da2_autotune
+from da2_common import XferMode
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+SPEEDS = [int(1e06), int(2e06), int(4e06), int(8e06)]
+
+
+def loopback_dac(limit):
+    # simulated timing : otherwise the fake's throughput does not depend on the clock
+    return DA2(backend = lambda: FakeSpiDev(max_reliable_hz = limit, loopback = True,
+                                            simulate_timing = True))
+
+
+def test_check_config_detects_corruption():
+    spi = FakeSpiDev(max_reliable_hz = int(2e06), loopback = True)
+    pattern = da2_autotune.test_pattern(1024)
+    original = list(pattern)
+    assert da2_autotune.check_config(spi, int(2e06), 256, XferMode.XFER2, pattern)[0]
+    assert not da2_autotune.check_config(spi, int(4e06), 256, XferMode.XFER2, pattern)[0]
+    assert not da2_autotune.check_config(spi, int(4e06), 256, XferMode.XFER3, pattern)[0]
+    assert pattern == original
+
+
+def test_no_loopback_fails():
+    spi = FakeSpiDev()
+    assert not da2_autotune.check_config(spi, int(1e06), 256, XferMode.XFER2, [1, 2, 3])[0]
+
+
+def test_sweep_stops_at_first_failing_clock():
+    dac = loopback_dac(int(2e06))
+    tuning, results = da2_autotune.autotune(dac, speeds = SPEEDS, chunk_sizes = [256])
+    assert tuning['spi_clock_speed'] == int(2e06)
+    assert dac.spi.max_speed_hz == int(2e06)
+    assert max(r['spi_clock_speed'] for r in results) == int(4e06)
+
+
+def test_tuned_dac_streams_its_buffer():
+    dac = loopback_dac(None)
+    dac.apply_tuning(dict(spi_clock_speed = int(1e06), chunk_size = 4, mode = 2))
+    dac.prepare_buffer([1, 2, 3])
+    for i in range(2):
+        dac.xfer2()
+    assert [p for t, m, p in dac.spi.transfers] == [b'\x00\x01\x00\x02', b'\x00\x03'] * 2
+
+
+def test_tuned_dac_applies_the_saved_tuning(monkeypatch):
+    from ut_dac_set_level import tuned_dac
+    tuning = dict(spi_clock_speed = int(4e06), chunk_size = 1024, mode = 3)
+    monkeypatch.setattr(da2_autotune, 'load_tuning', lambda dac: tuning)
+    dac, mode = tuned_dac(True, XferMode.XFER2, backend = FakeSpiDev)
+    assert (dac.spi.max_speed_hz, dac.chunk_size, mode) == (int(4e06), 1024, XferMode.XFER3)
+    dac, mode = tuned_dac(False, XferMode.XFER2, backend = FakeSpiDev)
+    assert (dac.chunk_size, mode) == (None, XferMode.XFER2)
+    monkeypatch.setattr(da2_autotune, 'load_tuning', lambda dac: None)
+    assert tuned_dac(True, XferMode.XFER1, backend = FakeSpiDev)[1] == XferMode.XFER1
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from da2_burst import BurstPlayer, FakeGpioEventSource
+from da2_common import SPIDEV_BUFSIZ, XferMode, encode
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+
+def fire(player, trigger, count, timeout = 5.0):
+    for i in range(count):
+        trigger.edge()
+        # wait for the burst to land before the next edge
+        deadline = time.monotonic() + timeout
+        while len(player.results) <= i:
+            if time.monotonic() > deadline:
+                pytest.fail('burst %d did not complete within %.1f s' % (i, timeout))
+            time.sleep(0.001)
+
+
+def test_refire_sends_the_preloaded_sequence_each_time():
+    dac = DA2(backend = FakeSpiDev)
+    player = BurstPlayer(dac)
+    values = list(range(3000))
+    player.preload('ramp', values)
+    trigger = FakeGpioEventSource()
+    player.arm('ramp', trigger, count = 3, timeout = 5)
+    fire(player, trigger, 3)
+    assert player.wait(5)
+    expected = encode(values)
+    sent = [bytes(payload) for t, method, payload in dac.spi.transfers]
+    chunks = [bytes(expected[i:i + SPIDEV_BUFSIZ]) for i in range(0, len(expected), SPIDEV_BUFSIZ)]
+    assert len(chunks) == 2
+    assert sent == chunks * 3
+    assert player.report()['bursts'] == 3
+
+
+def test_xfer3_burst_is_one_transfer():
+    dac = DA2(backend = FakeSpiDev)
+    player = BurstPlayer(dac, mode = XferMode.XFER3)
+    player.preload('step', [0, 4095])
+    trigger = FakeGpioEventSource()
+    player.arm('step', trigger, count = 2, timeout = 5)
+    fire(player, trigger, 2)
+    assert player.wait(5)
+    assert [payload for t, method, payload in dac.spi.transfers] == [bytes(encode([0, 4095]))] * 2
+
+
+def test_timeout_ends_the_burst():
+    player = BurstPlayer(DA2(backend = FakeSpiDev))
+    player.preload('one', [1])
+    player.arm('one', FakeGpioEventSource(), count = 1, timeout = 0.01)
+    assert player.wait(5)
+    assert player.report() == dict(bursts = 0)
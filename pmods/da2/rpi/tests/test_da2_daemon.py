@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from da2_common import SPIDEV_BUFSIZ, encode
+from da2_daemon import DA2Client, DA2Daemon
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+
+@pytest.fixture
+def daemon():
+    # short path : AF_UNIX socket paths are limited to ~108 bytes
+    directory = tempfile.mkdtemp(prefix = 'da2')
+    d = DA2Daemon(os.path.join(directory, 'da2.sock'), DA2(backend = FakeSpiDev))
+    thread = threading.Thread(target = d.serve_forever, daemon = True)
+    thread.start()
+    for i in range(100):
+        if os.path.exists(d.socket_path):
+            break
+        time.sleep(0.01)
+    yield d
+    d.shutdown()
+    thread.join(5)
+    shutil.rmtree(directory, ignore_errors = True)
+
+
+def payloads(d):
+    return [(method, payload) for t, method, payload in d.dac.spi.transfers]
+
+
+def test_level_runs_are_batched_in_order(daemon):
+    with DA2Client(daemon.socket_path) as client:
+        replies = client.command('LEVEL 1', 'LEVEL 2', 'PING', 'LEVEL 3')
+    assert replies == ['OK', 'OK', 'OK', 'OK']
+    assert payloads(daemon) == [('xfer2', bytes(encode([1, 2]))),
+                                ('xfer2', bytes(encode([3])))]
+
+
+def test_errors_keep_reply_order(daemon):
+    with DA2Client(daemon.socket_path) as client:
+        replies = client.command('LEVEL 1', 'BOGUS', 'LEVEL 70000', 'LEVEL 2')
+    assert replies[0] == 'OK'
+    assert replies[1].startswith('ERR unknown command')
+    assert replies[2].startswith('ERR level out of range')
+    assert replies[3] == 'OK'
+    assert payloads(daemon) == [('xfer2', bytes(encode([1]))),
+                                ('xfer2', bytes(encode([2])))]
+
+
+def test_stream_repeats_the_loaded_wave(daemon):
+    with DA2Client(daemon.socket_path) as client:
+        assert client.command('WAVE 1 2 4095', 'START 5') == ['OK 3', 'OK']
+        daemon.stream_thread.join(5)
+        assert client.command('STATS')[0].startswith('OK')
+    wave = bytes(encode([1, 2, 4095]))
+    assert payloads(daemon) == [('xfer2', wave)] * 5
+
+
+def test_long_wave_is_split_at_bufsiz(daemon):
+    values = list(range(4096))
+    with DA2Client(daemon.socket_path) as client:
+        replies = client.command('WAVE ' + ' '.join(map(str, values)), 'START 2')
+        assert replies == ['OK 4096', 'OK']
+        daemon.stream_thread.join(5)
+        stats = client.command('STATS')[0]
+    assert 'error=' not in stats
+    sent = payloads(daemon)
+    assert [len(p) for m, p in sent] == [SPIDEV_BUFSIZ] * 4
+    assert b''.join(p for m, p in sent) == bytes(encode(values)) * 2
+
+
+def test_stream_failure_is_reported_in_stats(daemon):
+    def broken(values):
+        raise OSError('spi gone')
+    with DA2Client(daemon.socket_path) as client:
+        client.command('WAVE 1 2 3')
+        daemon.dac.spi.xfer2 = broken
+        assert client.command('START 0') == ['OK']
+        daemon.stream_thread.join(5)
+        stats = client.command('STATS')[0]
+    assert 'streaming=0' in stats
+    assert stats.endswith('error=OSError: spi gone')
+
+
+def test_concurrent_starts_leave_one_stream(daemon, monkeypatch):
+    daemon.handle_batch(['WAVE 1 2 3'])
+    started = []
+    real = threading.Thread
+
+    def recording(*args, **kwargs):
+        thread = real(*args, **kwargs)
+        if kwargs.get('target') == daemon._stream:
+            started.append(thread)
+        return thread
+    clients = [real(target = daemon.handle_batch, args = (['START 0'],)) for i in range(8)]
+    monkeypatch.setattr(threading, 'Thread', recording)
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join(5)
+    monkeypatch.undo()
+    assert len(started) == 8
+    assert [t.is_alive() for t in started].count(True) == 1
+    daemon.stop_stream()
+    assert not any(t.is_alive() for t in started)
+
+
+def test_non_ascii_gets_err_and_keeps_connection(daemon):
+    with DA2Client(daemon.socket_path) as client:
+        client.sock.sendall(b'LEVEL \xff\n')
+        reply = client.sock.recv(4096)
+        assert reply.startswith(b'ERR')
+        assert client.command('PING') == ['OK']
+
+
+def test_fake_writes_received_bytes_in_place():
+    spi = FakeSpiDev()
+    tx = [1, 2]
+    assert spi.xfer2(tx) is tx and tx == [0xFF, 0xFF]
+    assert spi.xfer3([1, 2]) == (0xFF, 0xFF)
+    assert FakeSpiDev(loopback = True).xfer2([1, 2]) == [1, 2]
+    with pytest.raises(OverflowError):
+        spi.xfer2([0] * (SPIDEV_BUFSIZ + 1))
+    assert len(spi.xfer3([0] * (SPIDEV_BUFSIZ + 1))) == SPIDEV_BUFSIZ + 1
@@ -0,0 +1,38 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import da2_preview
+import ut_dac_set_level
+from da2_common import WaveformPattern, XferMode
+
+
+def test_script_and_helpers_share_enums():
+    assert ut_dac_set_level.XferMode is XferMode
+    assert ut_dac_set_level.WaveformPattern is WaveformPattern
+
+
+def test_envelope_keeps_spikes():
+    samples = np.zeros(1000000, dtype = np.uint16)
+    samples[123457] = 4095
+    x, lo, hi = da2_preview.envelope(samples, 1000)
+    assert x.size == lo.size == hi.size == 1000
+    assert hi.max() == 4095
+    assert lo.max() == 0
+
+
+def test_spi_timing_cs_frames():
+    timing = da2_preview.spi_timing(4096, int(1e06), XferMode.XFER2)
+    assert timing['bytes'] == 8192
+    assert timing['cs_frames'] == 2
+    assert timing['max_sample_rate_hz'] == 62500
+    assert da2_preview.spi_timing(10, int(1e06), XferMode.XFER1)['cs_frames'] == 20
+
+
+def test_render_html(tmp_path):
+    values = da2_preview.waveform(WaveformPattern.SINE, 100000, 3)
+    timing = da2_preview.spi_timing(values.size, int(1e06))
+    path = str(tmp_path / 'preview.html')
+    da2_preview.render(path, values, timing)
+    page = open(path).read()
+    assert '<svg' in page and 'cs_frames' in page
@@ -0,0 +1,67 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import da2_resample
+from da2_resample import LinearResampler, PolyphaseResampler, resample_stream
+
+SRC = 48000
+DST = 62345.7
+
+
+def run(resampler, x, size):
+    blocks = list(resample_stream((x[i:i + size] for i in range(0, x.size, size)), resampler))
+    return np.concatenate(blocks) if blocks else np.zeros(0)
+
+
+@pytest.mark.parametrize('kind', [LinearResampler, PolyphaseResampler])
+def test_chunked_matches_one_shot(kind):
+    x = np.random.default_rng(0).standard_normal(5000)
+    whole = run(kind(SRC, DST), x, x.size)
+    for size in (1, 7, 1000):
+        chunked = run(kind(SRC, DST), x, size)
+        assert chunked.size == whole.size
+        assert np.allclose(chunked, whole, rtol = 0, atol = 1e-9)
+
+
+@pytest.mark.parametrize('kind', [LinearResampler, PolyphaseResampler])
+def test_rate_error_is_bounded(kind):
+    r = kind(SRC, DST)
+    assert abs(r.rate_error_ppm) <= da2_resample.MAX_RATE_ERROR_PPM
+    with pytest.raises(ValueError):
+        kind(SRC, DST, max_error_ppm = 1e-6, max_denominator = 1000)
+
+
+def test_output_count_follows_ratio():
+    n = 30000
+    out = run(LinearResampler(SRC, DST), np.arange(n, dtype = np.float64), 4096)
+    assert abs(out.size - (n - 1) * DST / SRC) <= 1
+    # a ramp stays a ramp
+    assert np.allclose(np.diff(out), SRC / DST, rtol = 1e-5)
+
+
+def test_polyphase_exact_ratio():
+    r = PolyphaseResampler(2, 3)
+    assert (r.up, r.down, r.rate_error_ppm) == (3, 2, 0.0)
+    out = run(r, np.ones(2000), 256)
+    # flush() drains the filter delay with taps / 2 zeros
+    assert out.size == 3 * (2000 + r.taps // 2) // 2
+    assert np.allclose(out[100:2800], 1.0, atol = 1e-2)
+
+
+@pytest.mark.parametrize('dst', [10000, 625])
+def test_polyphase_downsampling_keeps_level(dst):
+    r = PolyphaseResampler(SRC, dst)
+    assert r.down > r.up
+    out = run(r, np.ones(100000), 4096)
+    # filter length in output samples, at both ends
+    edge = r.taps * r.up // r.down + 1
+    settled = out[edge:out.size - edge]
+    assert settled.size > 100
+    assert np.allclose(settled, 1.0, atol = 1e-6)
+
+
+def test_polyphase_downsampling_passes_a_low_tone():
+    t = np.arange(4 * SRC) / SRC
+    out = run(PolyphaseResampler(SRC, 625), np.sin(2 * np.pi * 50 * t), 4096)
+    assert abs(np.abs(out[500:-500]).max() - 1.0) < 0.01
@@ -0,0 +1,75 @@
+import time
+
+from da2_common import XferMode, encode
+from da2_supervisor import Supervisor, chunk, measure_overhead
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+SAFE = 2048
+
+
+def sent(dac):
+    return [p for t, m, p in dac.spi.transfers]
+
+
+def test_end_of_stream_leaves_the_safe_level():
+    dac = DA2(backend = FakeSpiDev)
+    chunks = chunk(encode(list(range(0, 4096, 4))), 512)
+    sup = Supervisor(dac, safe_level = SAFE)
+    sup.start(chunks, iterations = 3, handle_signals = False)
+    assert sup.wait(5)
+    sup.stop()
+    payloads = sent(dac)
+    assert sup.fault is None
+    assert payloads[:len(chunks)] == [bytes(c) for c in chunks]
+    # the streamed chunks are sent unchanged every iteration
+    assert payloads[:3 * len(chunks)] == [bytes(c) for c in chunks] * 3
+    assert payloads[-1] == bytes(encode([SAFE]))
+    assert sup.safe_frame == tuple(encode([SAFE]))
+
+
+def test_stall_trips_to_the_safe_level():
+    dac = DA2(backend = FakeSpiDev)
+    real = dac.spi.xfer2
+    calls = []
+
+    def stalling(values):
+        calls.append(1)
+        if len(calls) == 3:
+            time.sleep(0.5)
+        return real(values)
+    sup = Supervisor(dac, safe_level = SAFE, stall_timeout = 0.1, check_interval = 0.01)
+    sup.send = stalling
+    sup.start(chunk(encode([1, 2, 3, 4]), 2), handle_signals = False)
+    assert sup.wait(5)
+    sup.stop()
+    assert sup.fault.startswith('stall')
+    assert sent(dac)[-1] == bytes(encode([SAFE]))
+
+
+def test_writer_error_trips_to_the_safe_level():
+    dac = DA2(backend = FakeSpiDev)
+
+    def broken(values):
+        raise OSError('spi gone')
+    sup = Supervisor(dac, safe_level = SAFE, mode = XferMode.XFER3)
+    sup.send = broken
+    sup.start(chunk(encode([1])), iterations = 1, handle_signals = False)
+    assert sup.wait(5)
+    sup.stop()
+    assert sup.fault == 'error spi gone'
+    assert sent(dac) == [bytes(encode([SAFE]))] * 2
+
+
+def test_supervision_overhead_is_below_one_percent():
+    dac = DA2(backend = lambda: FakeSpiDev(simulate_timing = True, max_records = 0))
+    # 16 ms per 4096 byte chunk on the simulated wire
+    dac.spi.max_speed_hz = int(2e06)
+    bare, supervised, percent = measure_overhead(dac, chunk(encode(list(range(4096)))),
+                                                 iterations = 5, trials = 3)
+    assert percent < 1.0
+
+
+def test_report_before_start():
+    sup = Supervisor(DA2(backend = FakeSpiDev))
+    assert sup.report()['transfers'] == 0
@@ -0,0 +1,66 @@
+import threading
+
+import da2_timeline
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+PERIOD = 0.02
+SLICE_SAMPLES = 32
+BLOCK = [int(4095 * i / 255) for i in range(256)]
+
+
+def setup(devices):
+    tl = da2_timeline.Timeline(PERIOD, SLICE_SAMPLES)
+    dacs = []
+    for port, cs in devices:
+        dac = DA2(port, cs, backend = lambda: FakeSpiDev(simulate_timing = True))
+        tl.add('%d.%d' % (port, cs), dac)
+        dacs.append(dac)
+    return tl, dacs
+
+
+def test_skew_is_bounded_by_a_slice():
+    tl, dacs = setup([(0, 0), (0, 1), (1, 0)])
+    reports = tl.play(dict((name, iter(lambda: BLOCK, None)) for name in tl.devices), 20)
+    assert len(reports) == 20
+    # one slice on the shared bus at 1 MHz, plus scheduling slack
+    slice_us = 2 * SLICE_SAMPLES * 8 * 1e6 / dacs[0].spi.max_speed_hz
+    summary = da2_timeline.skew_summary(reports, skip = 5)
+    assert summary['blocks'] == 15
+    assert summary['skew_us_mean'] < slice_us + 2000
+    slices = len(BLOCK) // SLICE_SAMPLES
+    recorded = da2_timeline.recorded_skew(dacs, slices)
+    assert len(recorded) == 20
+    # every device received every sample of every block
+    for dac in dacs:
+        assert sum(len(p) for t, m, p in dac.spi.transfers) == 20 * 2 * len(BLOCK)
+
+
+def test_short_source_stops_playback():
+    tl, dacs = setup([(0, 0), (1, 0)])
+    blocks = {'0.0': iter([BLOCK] * 3), '1.0': iter(lambda: BLOCK, None)}
+    assert len(tl.play(blocks, 10)) == 3
+
+
+def test_failing_send_raises_instead_of_hanging():
+    tl, dacs = setup([(0, 0), (1, 0)])
+
+    def broken(values):
+        raise OSError('spi gone')
+    tl.devices['1.0']['send'] = broken
+    result = []
+
+    def run():
+        try:
+            tl.play(dict((name, iter(lambda: BLOCK, None)) for name in tl.devices), 5)
+        except OSError as e:
+            result.append(e)
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert str(result[0]) == 'spi gone'
+
+
+def test_skew_summary_empty():
+    assert da2_timeline.skew_summary([], skip = 10) == dict(blocks = 0)
@@ -0,0 +1,42 @@
+import hashlib
+
+import pytest
+
+from da2_common import encode
+from da2_trace import DIGEST_SIZE, TraceWriter, read_trace, replay
+from fake_spidev import FakeSpiDev
+from ut_dac_set_level import DA2
+
+
+def record(path, payload, values = (1, 2, 4095)):
+    writer = TraceWriter(str(path), payload = payload)
+    dac = DA2(backend = FakeSpiDev, trace = writer)
+    dac.xfer2(list(values))
+    dac.spi.xfer([0, 0])
+    writer.close()
+    return bytes(encode(list(values)))
+
+
+@pytest.mark.parametrize('payload', [True, False])
+def test_round_trip(tmp_path, payload):
+    path = tmp_path / 'run.da2t'
+    expected = record(path, payload)
+    header, records = read_trace(str(path))
+    assert header['max_speed_hz'] == 1000000
+    assert [(r[1], r[2]) for r in records] == [('xfer2', len(expected)), ('xfer', 2)]
+    assert records[0][0] <= records[1][0]
+    assert records[0][4] == hashlib.blake2b(expected, digest_size = DIGEST_SIZE).digest()
+    assert records[0][3] == (expected if payload else None)
+    stats = replay(str(path), max_speed = True, simulate_timing = False)
+    assert stats['transfers'] == 2
+
+
+@pytest.mark.parametrize('payload', [True, False])
+def test_truncated_trace_keeps_complete_records(tmp_path, payload):
+    path = tmp_path / 'cut.da2t'
+    record(path, payload)
+    data = path.read_bytes()
+    path.write_bytes(data[:-1])
+    with pytest.warns(UserWarning, match = 'partial record'):
+        header, records = read_trace(str(path))
+    assert [r[1] for r in records] == ['xfer2']
@@ -69,15 +69,25 @@ import typer
 #
 # TODO: investigate the differences and record the digital IO timeseries (can document using
 # the javascript plotting library which is bundled with a tool seen recently for ipynb ??)
-import spidev
+#
+# spidev/RPi.GPIO are only importable on the Pi : elsewhere pass backend = FakeSpiDev
+# (see fake_spidev.py) to exercise the driver without hardware.
+try:
+    import spidev
+except ImportError:
+    spidev = None
 # timing
 import time
 # GPIO
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    GPIO = None
 # cli
 import sys
 
 import pdb
+from typing import List
 """-----------------------------------------------------------"""
 
 # SPI connection parameters
@@ -108,49 +118,66 @@ class PmodSpiDev:
                 SPI_port = SPI_port,
                 CS_pin = CS_pin,
                 spi_clock_speed = spi_clock_speed,
-                spi_mode = 0b11):
+                spi_mode = 0b11,
+                backend = None,
+                trace = None):
+        """
+        backend : class with the spidev.SpiDev API (default spidev.SpiDev)
+        trace : da2_trace.TraceWriter recording every transfer (default off)
+        """
         self.SPI_port = SPI_port
         self.CS_pin = CS_pin
         self.spi_clock_speed = spi_clock_speed
         self.spi_mode = spi_mode
+        self.backend = backend
+        self.trace = trace
         self.setup()
 
     def setup(self):
-        self.spi = spidev.SpiDev()
+        backend = self.backend if self.backend is not None else spidev.SpiDev
+        self.spi = backend()
         self.spi.open(self.SPI_port, self.CS_pin)
         self.spi.max_speed_hz = self.spi_clock_speed
         self.spi.mode = self.spi_mode
+        if self.trace is not None:
+            from da2_trace import TracingSpiDev
+            self.spi = TracingSpiDev(self.spi, self.trace)
 
-from enum import Enum
-
-class XferMode(Enum):
-    XFER1 = 1
-    XFER2 = 2
-    XFER3 = 3
-
-class WaveformPattern(Enum):
-    LEVELS = 1
-    RAMP = 2
-    SINE = 3
-    TRIANGULAR = 4
-
+from da2_common import XferMode, WaveformPattern, encode
 
 class DA2:
     def __init__(self, 
                 SPI_port = SPI_port,
                 CS_pin = CS_pin,
                 spi_clock_speed = spi_clock_speed,
-                spi_mode = 0b11):
-        self.pmod = PmodSpiDev(SPI_port, CS_pin, spi_clock_speed,spi_mode)
+                spi_mode = 0b11,
+                backend = None,
+                trace = None):
+        self.pmod = PmodSpiDev(SPI_port, CS_pin, spi_clock_speed,spi_mode, backend, trace)
         self.spi = self.pmod.spi
+        self.chunk_size = None
+        self.buffer = []
+        self.chunks = []
 
     def prepare_buffer(self, values):
-        """TODO: potentially make more efficient."""
-        self.buffer = []
-        for v in values:
-            highbyte = v >> 8
-            lowbyte = v & 0xFF
-            self.buffer.extend([highbyte, lowbyte])
+        self.buffer = encode(values)
+        self.chunk_buffer()
+
+    def chunk_buffer(self):
+        """Split the buffer into chunk_size transfers (None = one transfer)."""
+        if self.chunk_size is None:
+            self.chunks = [self.buffer]
+        else:
+            n = self.chunk_size
+            self.chunks = [self.buffer[i:i + n] for i in range(0, len(self.buffer), n)]
+
+    def apply_tuning(self, tuning):
+        """Use an autotune result (see da2_autotune.py); returns the tuned XferMode."""
+        self.pmod.spi_clock_speed = tuning['spi_clock_speed']
+        self.spi.max_speed_hz = tuning['spi_clock_speed']
+        self.chunk_size = tuning['chunk_size']
+        self.chunk_buffer()
+        return XferMode(tuning['mode'])
         
     def loop(self, iterations = 0, type = None, mode = XferMode.XFER1):
         """iterations 0 = forever. Rudimentary caching of levels/ramp/sinusoids""" 
@@ -179,17 +206,20 @@ class DA2:
     def xfer(self, values = None):
         if values is not None:
             self.prepare_buffer(values)
-        self.spi.xfer(self.buffer)
+        for chunk in self.chunks:
+            self.spi.xfer(list(chunk))
 
     def xfer2(self, values = None):
         if values is not None:
             self.prepare_buffer(values)
-        self.spi.xfer2(self.buffer)
+        for chunk in self.chunks:
+            self.spi.xfer2(list(chunk))
     
-    def xfer3(self, values):
+    def xfer3(self, values = None):
         if values is not None:
             self.prepare_buffer(values)
-        self.spi.xfer3(self.buffer)
+        for chunk in self.chunks:
+            self.spi.xfer3(list(chunk))
 
     def close(self):
         self.spi.close()
@@ -209,21 +239,263 @@ def test_suite_a(delta_t = 0.1):
         dac.loop(iterations = 0, type = None, mode = XferMode.XFER1)
         time.sleep(delta_t)
 
-# typer CLI support for development
+def tuned_dac(tuned = False, mode = XferMode.XFER2, *args, **kwargs):
+    """
+    DA2(*args, **kwargs), at the device's saved autotune clock and chunk size when
+    tuned is set (see da2_autotune.py).  Returns (dac, mode) where mode is the tuned
+    XferMode if there is one, else the mode passed in.
+    """
+    dac = DA2(*args, **kwargs)
+    if tuned:
+        from da2_autotune import device_key, load_tuning
+        tuning = load_tuning(dac)
+        if tuning is None:
+            print("No saved tuning for %s : run autotune" % device_key(dac))
+        else:
+            mode = dac.apply_tuning(tuning)
+    return dac, mode
+
+# typer CLI support for development.  --tuned runs at the autotuned configuration.
 
 app = typer.Typer()
 
 @app.command()
-def levels(maxbits: int = 12, iterations: int = 1, loop_delay: float = 0.1, value_delay: float = 1.0):
-    dac = DA2()
+def levels(maxbits: int = 12, iterations: int = 1, loop_delay: float = 0.1, value_delay: float = 1.0,
+           tuned: bool = False):
+    dac, mode = tuned_dac(tuned, XferMode.XFER1)
     for i in range(0, iterations):
         for value in [2**i for i in range(0, maxbits)]:
             print("Set level output to %d" % value)
             dac.set_levels([value - 1])
-            dac.loop(iterations, type = WaveformPattern.LEVELS, mode = XferMode.XFER1)
+            dac.loop(iterations, type = WaveformPattern.LEVELS, mode = mode)
             time.sleep(value_delay)
         time.sleep(loop_delay)
 
+# Persistent DAC daemon : pays the startup/SPI open cost once, then takes
+# commands over a Unix domain socket (see da2_daemon.py).  --trace records the
+# transfers as digests, add --trace-payload to keep the bytes (needed by preview).
+
+DAEMON_SOCKET = '/tmp/da2.sock'
+
+@app.command()
+def daemon(socket_path: str = DAEMON_SOCKET, fake: bool = False, trace: str = '',
+           trace_payload: bool = False, tuned: bool = False):
+    from da2_daemon import DA2Daemon
+    backend = None
+    if fake:
+        from fake_spidev import FakeSpiDev
+        backend = lambda: FakeSpiDev(max_records = 1024)
+    writer = None
+    if trace:
+        from da2_trace import TraceWriter
+        writer = TraceWriter(trace, payload = trace_payload)
+    try:
+        DA2Daemon(socket_path, tuned_dac(tuned, backend = backend, trace = writer)[0]).serve_forever()
+    finally:
+        if writer is not None:
+            writer.close()
+
+@app.command()
+def send(commands: List[str], socket_path: str = DAEMON_SOCKET):
+    from da2_daemon import DA2Client
+    with DA2Client(socket_path) as client:
+        for reply in client.command(*commands):
+            print(reply)
+
+# Trigger synchronised bursts from preloaded sequences (see da2_burst.py).
+# gpio_line < 0 uses a software trigger fired every period seconds.
+
+@app.command()
+def burst(fires: int = 10, start: int = 0, end: int = 4096, delta: int = 1,
+          gpio_chip: str = '/dev/gpiochip0', gpio_line: int = -1,
+          period: float = 0.1, fake: bool = False, tuned: bool = False):
+    from da2_burst import BurstPlayer, GpioEdgeTrigger, SoftwareTrigger
+    backend = None
+    if fake:
+        from fake_spidev import FakeSpiDev
+        backend = FakeSpiDev
+    dac, mode = tuned_dac(tuned, backend = backend)
+    player = BurstPlayer(dac, mode)
+    player.preload('ramp', list(range(start, end, delta)))
+    if gpio_line >= 0:
+        trigger = GpioEdgeTrigger(gpio_chip, gpio_line)
+    else:
+        trigger = SoftwareTrigger()
+    player.arm('ramp', trigger, count = fires)
+    print("Armed %d bursts" % fires)
+    while not player.wait(period):
+        if gpio_line < 0:
+            trigger.fire()
+    trigger.close()
+    dac.close()
+    for k, v in player.report().items():
+        print("%s = %s" % (k, v))
+
+
+# Clock/chunk/mode autotuning against a MOSI->MISO loopback (see da2_autotune.py).
+# --fake-limit emulates wiring that fails above that clock.
+
+@app.command()
+def autotune(save: bool = True, fake: bool = False, fake_limit: int = int(2e06)):
+    import da2_autotune
+    backend = None
+    if fake:
+        from fake_spidev import FakeSpiDev
+        backend = lambda: FakeSpiDev(simulate_timing = True, max_records = 0,
+                                     max_reliable_hz = fake_limit, loopback = True)
+    dac = DA2(backend = backend)
+    tuning, results = da2_autotune.autotune(dac, verbose = True)
+    dac.close()
+    if tuning is None:
+        print("No error free configuration found : check the loopback wiring")
+        raise typer.Exit(1)
+    print("Best : %s" % tuning)
+    if save:
+        da2_autotune.save_tuning(dac, tuning)
+        print("Saved to %s" % da2_autotune.TUNING_FILE)
+
+# Hardware free preview (see da2_preview.py) : pattern is ramp/sine/triangular/levels,
+# or pass --trace to preview a trace recorded with payloads.  Output .html or .png.
+
+@app.command()
+def preview(output: str = 'preview.html', pattern: str = 'ramp', samples: int = 4096,
+            periods: int = 1, levels: str = '0,4095', trace: str = '',
+            clock: int = spi_clock_speed, mode: int = 2, spi_mode: int = 0b11,
+            chunk_size: int = 0, width: int = 1600):
+    import da2_preview
+    if trace:
+        values, header = da2_preview.trace_samples(trace)
+        clock = header['max_speed_hz'] or clock
+        spi_mode = header['spi_mode']
+        title = trace
+    else:
+        values = da2_preview.waveform(WaveformPattern[pattern.upper()], samples, periods,
+                                      levels = [int(v) for v in levels.split(',')])
+        title = '%s x %d' % (pattern, periods)
+    timing = da2_preview.spi_timing(len(values), clock, XferMode(mode), spi_mode, chunk_size or None)
+    da2_preview.render(output, values, timing, title, width)
+    for k, v in timing.items():
+        print("%-20s %s" % (k, v))
+    print("Wrote %s" % output)
+
+# Rate conversion of source data to the DAC rate (see da2_resample.py).  The input
+# is .npy or raw samples (--dtype); output is raw uint16 DA2 codes.  dst_rate 0
+# measures what the DA2 achieves at the configured clock and mode.  The rate actually
+# produced is within --max-error-ppm of dst_rate.
+
+@app.command()
+def resample(source: str, output: str, src_rate: float, dst_rate: float = 0,
+             kind: str = 'polyphase', dtype: str = 'int16', gain: float = 1.0, offset: float = 0.0,
+             mode: int = 2, fake: bool = False, max_error_ppm: float = 1.0, tuned: bool = False):
+    import da2_resample
+    if dst_rate <= 0:
+        backend = None
+        if fake:
+            from fake_spidev import FakeSpiDev
+            backend = lambda: FakeSpiDev(simulate_timing = True, max_records = 0)
+        dac, xfer_mode = tuned_dac(tuned, XferMode(mode), backend = backend)
+        dst_rate = da2_resample.achievable_rate(dac, xfer_mode)
+        dac.close()
+        print("Measured DAC rate %.1f samples/s" % dst_rate)
+    resampler = da2_resample.RESAMPLERS[kind](src_rate, dst_rate, max_error_ppm = max_error_ppm)
+    print("Rate error %+.3f ppm" % resampler.rate_error_ppm)
+    produced = 0
+    start = time.perf_counter()
+    with open(output, 'wb') as f:
+        for block in da2_resample.resample_stream(da2_resample.read_chunks(source, dtype), resampler):
+            da2_resample.to_codes(block, gain, offset).tofile(f)
+            produced += block.size
+    consumed = resampler.consumed
+    elapsed = time.perf_counter() - start
+    print("%d samples at %.1f Hz -> %d samples at %.1f Hz in %.3f s (%.1f x real time)" %
+          (consumed, src_rate, produced, dst_rate, elapsed, consumed / src_rate / elapsed))
+
+# Phase aligned playback on several DA2s (see da2_timeline.py).  devices is a
+# comma separated list of SPI port.cs; each plays the same ramp, block by block.
+# --tuned sets each device's saved clock; mode applies to every device.
+
+@app.command()
+def timeline(devices: str = '0.0,0.1,1.0', blocks: int = 100, block_samples: int = 256,
+             period: float = 0.02, slice_samples: int = 32, mode: int = 2, fake: bool = False,
+             tuned: bool = False):
+    import da2_timeline
+    backend = None
+    if fake:
+        from fake_spidev import FakeSpiDev
+        backend = lambda: FakeSpiDev(simulate_timing = True)
+    tl = da2_timeline.Timeline(period, slice_samples, mode = XferMode(mode))
+    dacs = []
+    for spec in devices.split(','):
+        port, cs = [int(v) for v in spec.split('.')]
+        dac = tuned_dac(tuned, XferMode(mode), port, cs, backend = backend)[0]
+        tl.add(spec, dac)
+        dacs.append(dac)
+    ramp = [int(4095 * i / (block_samples - 1)) for i in range(block_samples)]
+    reports = tl.play(dict((spec, iter(lambda: ramp, None)) for spec in devices.split(',')), blocks)
+    skip = min(10, len(reports) // 2)
+    for k, v in da2_timeline.skew_summary(reports, skip = skip).items():
+        print("%-14s %s" % (k, v))
+    if fake:
+        slices = -(-block_samples // slice_samples)
+        recorded = da2_timeline.recorded_skew(dacs, slices)[skip:]
+        if recorded:
+            print("%-14s %.1f us mean, %.1f us max (fake backend timestamps)" %
+                  ('recorded skew', sum(recorded) / len(recorded) / 1e3, max(recorded) / 1e3))
+    for dac in dacs:
+        dac.close()
+
+# Supervised continuous output (see da2_supervisor.py) : streams a ramp until
+# Ctrl-C, a stall or a throughput collapse, then leaves the DAC at safe_level.
+# --overhead measures the supervisor cost instead of streaming.
+
+@app.command()
+def stream(start: int = 0, end: int = 4096, delta: int = 1, iterations: int = 0,
+           safe_level: int = 0, stall_timeout: float = 0.5, min_throughput: float = 0,
+           mode: int = 2, overhead: bool = False, fake: bool = False, tuned: bool = False):
+    import da2_supervisor
+    from da2_common import SPIDEV_BUFSIZ
+    backend = None
+    if fake:
+        from fake_spidev import FakeSpiDev
+        backend = lambda: FakeSpiDev(simulate_timing = True, max_records = 0)
+    dac, xfer_mode = tuned_dac(tuned, XferMode(mode), backend = backend)
+    dac.set_ramp(start, end, delta)
+    chunks = da2_supervisor.chunk(dac.buffer, dac.chunk_size or SPIDEV_BUFSIZ)
+    if overhead:
+        bare, supervised, percent = da2_supervisor.measure_overhead(dac, chunks, mode = xfer_mode)
+        print("bare %.0f B/s supervised %.0f B/s overhead %.3f %%" % (bare, supervised, percent))
+    else:
+        sup = da2_supervisor.Supervisor(dac, safe_level, stall_timeout, min_throughput,
+                                        mode = xfer_mode)
+        sup.start(chunks, iterations)
+        sup.wait()
+        sup.stop()
+        for k, v in sup.report().items():
+            print("%-16s %s" % (k, v))
+    dac.close()
+
+# Transfer traces (see da2_trace.py) : replay a recorded trace against the fake
+# backend and report throughput/jitter, optionally against a second trace
+# recorded with another version of the code.
+
+@app.command()
+def replay(trace: str, against: str = '', max_speed: bool = False, simulate_timing: bool = True):
+    import da2_trace
+    results = []
+    for path in [p for p in (trace, against) if p]:
+        recorded = da2_trace.recorded_stats(path)
+        replayed = da2_trace.replay(path, max_speed = max_speed, simulate_timing = simulate_timing)
+        results.append(replayed)
+        print("%s" % path)
+        for k in recorded:
+            print("\t%-24s recorded %14.3f replayed %14.3f" % (k, recorded[k], replayed.get(k, 0)))
+        for k in replayed:
+            if k not in recorded:
+                print("\t%-24s %14.3f" % (k, replayed[k]))
+    if len(results) == 2:
+        print("%s vs %s (replayed)" % (trace, against))
+        for k, a, b, ratio in da2_trace.compare(*results):
+            print("\t%-24s %14.3f %14.3f  x%.3f" % (k, a, b, ratio))
 
 
 if __name__ == '__main__':